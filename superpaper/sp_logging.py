@@ -2,6 +2,8 @@
 
 import logging
 import os
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 from superpaper.sp_paths import TEMP_PATH
 
@@ -23,6 +25,38 @@ elif LOGGING:
     CONSOLE_HANDLER = logging.StreamHandler()
     G_LOGGER.addHandler(CONSOLE_HANDLER)
 
+
+class _DroppingQueueHandler(QueueHandler):
+    """QueueHandler for a bounded queue that drops records when it is full."""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+# Verbose tracing of the video wallpaper code, enabled with the SP_DEBUG
+# environment variable. Records are handed to a bounded queue and written by
+# a daemon listener thread, so file I/O stays off the calling thread.
+DEBUG_LOGGER = logging.getLogger("superpaper.debug")
+DEBUG_LOGGER.propagate = False
+DEBUG_LISTENER = None
+if os.environ.get("SP_DEBUG"):
+    _DEBUG_QUEUE = queue.Queue(maxsize=10000)
+    DEBUG_LOGGER.setLevel(logging.DEBUG)
+    DEBUG_LOGGER.addHandler(_DroppingQueueHandler(_DEBUG_QUEUE))
+    DEBUG_LISTENER = QueueListener(
+        _DEBUG_QUEUE,
+        RotatingFileHandler(os.path.join(TEMP_PATH, "debug.log"),
+                            maxBytes=1 << 20, backupCount=3)
+    )
+    DEBUG_LISTENER.start()
+
+def get_debug_logger(name):
+    """Return the SP_DEBUG trace logger of a module."""
+    return DEBUG_LOGGER.getChild(name)
+
 def custom_exception_handler(exceptiontype, value, tb_var):
     """Log uncaught exceptions."""
     G_LOGGER.exception("Uncaught exception type: %s", str(exceptiontype))
@@ -2,7 +2,7 @@
 Video Wallpaper Daemon for Superpaper on macOS.
 
 This daemon runs as a separate process and plays video wallpapers
-using AVPlayer in a window positioned at desktop level.
+using AVPlayer in one window per display, positioned at desktop level.
 
 Inspired by LiveWallpaper app architecture.
 """
@@ -10,10 +10,12 @@ Inspired by LiveWallpaper app architecture.
 import sys
 import signal
 import os
+import json
 from threading import Thread
 
 from Foundation import (
-    NSObject, NSURL, NSNotificationCenter,
+    NSObject, NSURL, NSOperationQueue,
+    NSKeyValueObservingOptionInitial, NSKeyValueObservingOptionNew,
     CFNotificationCenterGetDarwinNotifyCenter,
     CFNotificationCenterAddObserver,
     kCFNotificationDeliverImmediately,
@@ -25,16 +27,23 @@ from AppKit import (
     NSColor, NSImage
 )
 from AVFoundation import (
-    AVPlayer, AVPlayerLayer, AVPlayerItem,
+    AVURLAsset, AVURLAssetPreferPreciseDurationAndTimingKey,
+    AVAssetImageGenerator, AVKeyValueStatusLoaded,
+    AVQueuePlayer, AVPlayerLooper, AVPlayerLayer, AVPlayerItem,
+    AVPlayerStatusUnknown, AVPlayerStatusReadyToPlay,
     AVLayerVideoGravityResize, AVLayerVideoGravityResizeAspect,
     AVLayerVideoGravityResizeAspectFill
 )
+from CoreMedia import CMTimeMultiplyByRatio
 from Quartz import (
     CGWindowLevelForKey, kCGDesktopWindowLevelKey,
     CGDisplayBounds
 )
 import objc
 
+TERMINATE_NOTIFICATION = "com.superpaper.video.terminate"
+STATIC_IMAGE_DELAY = 0.05  # seconds
+
 
 class VideoWallpaperWindow(NSWindow):
     """Window that displays video at desktop wallpaper level."""
@@ -70,30 +79,33 @@ class VideoWallpaperWindow(NSWindow):
         self.current_volume = volume
         self.scale_mode = scale_mode
         
-        # Create player view
-        self.setupVideoPlayer()
+        self.player = None
+        self.player_item = None
+        self.looper = None
+        self.observing_status = False
+        self.image_view = None
+        self.generated_image = None
+        self.static_check_done = False
+        self.has_static_file = bool(static_path) and os.path.exists(static_path)
+        self.is_local_file = os.path.exists(video_path)
         
-        # Show static image first (for faster startup)
-        if static_path and os.path.exists(static_path):
-            self.showStaticImage()
+        # Create player layer; the player is attached once the asset is loaded
+        self.setupPlayerLayer()
         
-        # Start video playback
-        self.startVideo()
+        # Load the asset once and share it between playback and frame extraction
+        self.loadAsset()
+        
+        # Give a warm asset a moment to become displayable before falling
+        # back to the static image
+        self.performSelector_withObject_afterDelay_(
+            "showStaticImageIfNeeded:", None, STATIC_IMAGE_DELAY
+        )
         
         return self
     
-    def setupVideoPlayer(self):
-        """Setup AVPlayer and layer."""
-        # Create player
-        video_url = NSURL.fileURLWithPath_(self.video_path)
-        self.player_item = AVPlayerItem.playerItemWithURL_(video_url)
-        self.player = AVPlayer.playerWithPlayerItem_(self.player_item)
-        
-        # Set volume
-        self.player.setVolume_(self.current_volume)
-        
-        # Create player layer
-        self.player_layer = AVPlayerLayer.playerLayerWithPlayer_(self.player)
+    def setupPlayerLayer(self):
+        """Setup the AVPlayerLayer that will display the video."""
+        self.player_layer = AVPlayerLayer.playerLayerWithPlayer_(None)
         
         # Set scale mode
         if self.scale_mode == "fill":
@@ -109,36 +121,167 @@ class VideoWallpaperWindow(NSWindow):
         # Add layer to window
         self.contentView().setWantsLayer_(True)
         self.contentView().layer().addSublayer_(self.player_layer)
+    
+    def loadAsset(self):
+        """Load the video asset asynchronously, then start playback on the main thread."""
+        video_url = NSURL.fileURLWithPath_(self.video_path)
+        self.asset = AVURLAsset.URLAssetWithURL_options_(
+            video_url, {AVURLAssetPreferPreciseDurationAndTimingKey: False}
+        )
+        needs_static = not self.has_static_file
         
-        # Setup loop notification
-        NSNotificationCenter.defaultCenter().addObserver_selector_name_object_(
-            self,
-            "playerItemDidReachEnd:",
-            "AVPlayerItemDidPlayToEndTimeNotification",
-            self.player_item
+        def handler():
+            # Runs on an AVFoundation queue, so extract the placeholder frame here
+            static_image = self.generateStaticImage() if needs_static else None
+            NSOperationQueue.mainQueue().addOperationWithBlock_(
+                lambda: self.assetDidLoad_(static_image)
+            )
+        
+        self.asset.loadValuesAsynchronouslyForKeys_completionHandler_(
+            ["tracks", "duration"], handler
         )
     
+    def assetLoaded(self):
+        """Whether the asset's tracks finished loading successfully."""
+        status, error = self.asset.statusOfValueForKey_error_("tracks", None)
+        if status != AVKeyValueStatusLoaded:
+            print(f"Failed to load video asset: {error}")
+            return False
+        return True
+    
+    def generateStaticImage(self):
+        """Extract the midpoint frame from the loaded asset as a CGImage."""
+        if not self.assetLoaded():
+            return None
+        generator = AVAssetImageGenerator.assetImageGeneratorWithAsset_(self.asset)
+        generator.setAppliesPreferredTrackTransform_(True)
+        midpoint_time = CMTimeMultiplyByRatio(self.asset.duration(), 1, 2)
+        image_ref = generator.copyCGImageAtTime_actualTime_error_(midpoint_time, None, None)[0]
+        return image_ref
+    
+    def assetDidLoad_(self, static_image):
+        """Create the player from the loaded asset and start playback."""
+        if not self.assetLoaded():
+            return
+        self.generated_image = static_image
+        if self.static_check_done:
+            self.showStaticImageIfNeeded_(None)
+        self.setupVideoPlayer()
+    
+    def setupVideoPlayer(self):
+        """Setup AVPlayer from the loaded asset and attach it to the layer."""
+        self.player_item = AVPlayerItem.playerItemWithAsset_(self.asset)
+        self.player = AVQueuePlayer.queuePlayerWithItems_([self.player_item])
+        
+        # Local files don't need the network stall-avoidance buffering
+        if self.is_local_file:
+            self.player.setAutomaticallyWaitsToMinimizeStalling_(False)
+        
+        # Let the looper schedule the next iteration inside the media pipeline
+        self.looper = AVPlayerLooper.playerLooperWithPlayer_templateItem_(
+            self.player, self.player_item
+        )
+        
+        # Set volume
+        self.player.setVolume_(self.current_volume)
+        
+        self.player_layer.setPlayer_(self.player)
+        
+        # Preroll requires a ready player, so wait for its status first.
+        # The initial notification is delivered during addObserver, so the
+        # flag must already be set
+        self.observing_status = True
+        self.player.addObserver_forKeyPath_options_context_(
+            self, "status",
+            NSKeyValueObservingOptionInitial | NSKeyValueObservingOptionNew,
+            None
+        )
+    
+    def observeValueForKeyPath_ofObject_change_context_(self, key_path, obj, change, context):
+        """Preroll the player once it becomes ready to play."""
+        if key_path != "status" or not self.observing_status:
+            return
+        status = obj.status()
+        if status == AVPlayerStatusUnknown:
+            return
+        obj.removeObserver_forKeyPath_(self, "status")
+        self.observing_status = False
+        if status == AVPlayerStatusReadyToPlay:
+            NSOperationQueue.mainQueue().addOperationWithBlock_(self.prerollVideo)
+        else:
+            print(f"Player failed: {obj.error()}")
+    
+    def prerollVideo(self):
+        """Warm up the decoder while the static image is still on screen."""
+        def handler(finished):
+            NSOperationQueue.mainQueue().addOperationWithBlock_(
+                lambda: self.prerollDidFinish_(finished)
+            )
+        
+        self.player.prerollAtRate_completionHandler_(1.0, handler)
+    
+    def prerollDidFinish_(self, finished):
+        """Start playback and drop the static image once frames are ready."""
+        if self.looper is None:
+            return
+        # An interrupted preroll still needs playback to start; only the
+        # image swap waits for frames to be available
+        self.startVideo()
+        if finished:
+            self.hideStaticImage()
+        else:
+            self.hideStaticImageWhenReady_(None)
+    
+    def hideStaticImageWhenReady_(self, sender):
+        """Drop the static image once the video layer can display frames."""
+        if self.image_view is None or self.looper is None:
+            return
+        if not self.player_layer.isReadyForDisplay():
+            self.performSelector_withObject_afterDelay_(
+                "hideStaticImageWhenReady:", None, STATIC_IMAGE_DELAY
+            )
+            return
+        self.hideStaticImage()
+    
+    def hideStaticImage(self):
+        """Remove the static image view, if shown."""
+        if self.image_view is not None:
+            self.image_view.removeFromSuperview()
+            self.image_view = None
+    
+    def showStaticImageIfNeeded_(self, sender):
+        """Show the static image unless the video is already ready to display."""
+        self.static_check_done = True
+        if self.image_view is not None or self.player_layer.isReadyForDisplay():
+            return
+        if self.has_static_file:
+            self.showStaticImage()
+        elif self.generated_image is not None:
+            self.showImage_(self.generated_image)
+    
     def showStaticImage(self):
         """Show static image while video loads."""
         try:
             static_image = NSImage.alloc().initWithContentsOfFile_(self.static_path)
             if static_image:
-                image_view = NSView.alloc().initWithFrame_(self.contentView().bounds())
-                image_view.setWantsLayer_(True)
-                image_view.layer().setContents_(static_image)
-                self.contentView().addSubview_(image_view)
+                self.showImage_(static_image)
         except Exception as e:
             print(f"Failed to load static image: {e}")
     
+    def showImage_(self, image):
+        """Overlay an image (NSImage or CGImage) on the window until video starts."""
+        image_view = NSView.alloc().initWithFrame_(self.contentView().bounds())
+        image_view.setWantsLayer_(True)
+        image_view.layer().setContents_(image)
+        self.contentView().addSubview_(image_view)
+        self.image_view = image_view
+    
     def startVideo(self):
         """Start video playback."""
-        self.player.play()
-    
-    def playerItemDidReachEnd_(self, notification):
-        """Loop video when it reaches the end."""
-        from CoreMedia import kCMTimeZero
-        self.player.seekToTime_(kCMTimeZero)
-        self.player.play()
+        if self.is_local_file:
+            self.player.playImmediatelyAtRate_(1.0)
+        else:
+            self.player.play()
     
     def updateVolume_(self, new_volume):
         """Update playback volume."""
@@ -148,31 +291,44 @@ class VideoWallpaperWindow(NSWindow):
     
     def cleanup(self):
         """Cleanup resources."""
+        NSObject.cancelPreviousPerformRequestsWithTarget_(self)
+        self.asset.cancelLoading()
+        if self.observing_status:
+            self.player.removeObserver_forKeyPath_(self, "status")
+            self.observing_status = False
         if self.player:
+            self.player.cancelPendingPrerolls()
             self.player.pause()
-        NSNotificationCenter.defaultCenter().removeObserver_(self)
+        if self.looper:
+            self.looper.disableLooping()
+        self.looper = None
 
 
 class VideoDaemonDelegate(NSObject):
     """Application delegate for video daemon."""
     
-    def initWithWindow_(self, window):
-        """Initialize delegate with window."""
+    def initWithWindows_(self, windows):
+        """Initialize delegate with the daemon's wallpaper windows."""
         self = objc.super(VideoDaemonDelegate, self).init()
         if self is None:
             return None
         
-        self.window = window
+        self.windows = windows
         self.setupNotifications()
         return self
     
     def setupNotifications(self):
         """Setup CFNotification observers for IPC."""
-        # CFNotification callbacks don't work well as instance methods in PyObjC
-        # We'll use NSNotificationCenter for local notifications instead
-        # For now, we'll skip CFNotification and rely on process signals
-        pass
-        # Note: Terminate will be handled by signal handlers
+        # The Darwin center ignores the observer pointer and object, so the
+        # callback is a module-level function rather than an instance method
+        CFNotificationCenterAddObserver(
+            CFNotificationCenterGetDarwinNotifyCenter(),
+            None,
+            terminate_callback,
+            TERMINATE_NOTIFICATION,
+            None,
+            kCFNotificationDeliverImmediately
+        )
         # Volume and space changes are not critical for basic functionality
     
     def applicationDidFinishLaunching_(self, notification):
@@ -180,34 +336,49 @@ class VideoDaemonDelegate(NSObject):
         print("Video daemon started successfully")
 
 
+@objc.callbackFor(CFNotificationCenterAddObserver)
+def terminate_callback(center, observer, name, obj, user_info):
+    """Terminate the daemon when the engine broadcasts the terminate notification."""
+    print("Received terminate notification, terminating...")
+    NSApplication.sharedApplication().terminate_(None)
+
+
 def signal_handler(signum, frame):
     """Handle termination signals."""
     print(f"Received signal {signum}, terminating...")
     NSApplication.sharedApplication().terminate_(None)
 
 
+def find_screen(screens, display_id):
+    """Return the NSScreen with the given NSScreenNumber, or None."""
+    for screen in screens:
+        screen_dict = screen.deviceDescription()
+        screen_number = screen_dict.get("NSScreenNumber", 0)
+        if screen_number == display_id:
+            return screen
+    return None
+
+
 def main():
-    """Main entry point for video daemon."""
-    if len(sys.argv) < 6:
-        print("Usage: video_daemon.py <video_path> <static_path> <volume> <scale_mode> <display_id>")
-        sys.exit(1)
-    
-    video_path = sys.argv[1]
-    static_path = sys.argv[2]
-    volume = float(sys.argv[3])
-    scale_mode = sys.argv[4]
-    display_id = int(sys.argv[5]) if sys.argv[5] else 0
+    """
+    Main entry point for video daemon.
     
-    print(f"Starting video daemon:")
-    print(f"  Video: {video_path}")
-    print(f"  Static: {static_path}")
-    print(f"  Volume: {volume}")
-    print(f"  Scale: {scale_mode}")
-    print(f"  Display: {display_id}")
+    A single daemon process serves every display. The wallpapers are passed
+    as a JSON list (as the only argument, or on stdin when the argument
+    is "-"), one entry per display:
+        [{"video_path", "static_path", "volume", "scale_mode", "display_id"}, ...]
+    """
+    if len(sys.argv) != 2:
+        print("Usage: video_daemon.py <wallpapers_json | ->")
+        sys.exit(1)
     
-    # Verify video file exists
-    if not os.path.exists(video_path):
-        print(f"ERROR: Video file not found: {video_path}")
+    try:
+        if sys.argv[1] == "-":
+            wallpapers = json.load(sys.stdin)
+        else:
+            wallpapers = json.loads(sys.argv[1])
+    except ValueError as e:
+        print(f"ERROR: Invalid wallpaper list: {e}")
         sys.exit(1)
     
     # Setup signal handlers
@@ -218,38 +389,56 @@ def main():
     app = NSApplication.sharedApplication()
     app.setActivationPolicy_(2)  # NSApplicationActivationPolicyAccessory
     
-    # Find target screen
     screens = NSScreen.screens()
-    target_screen = None
-    
-    for screen in screens:
-        screen_dict = screen.deviceDescription()
-        screen_number = screen_dict.get("NSScreenNumber", 0)
-        if screen_number == display_id:
-            target_screen = screen
-            break
+    windows = []
     
-    if target_screen is None:
-        print(f"WARNING: Display {display_id} not found, using main screen")
-        target_screen = NSScreen.mainScreen()
-    
-    # Create video window
-    window = VideoWallpaperWindow.alloc().initWithScreen_videoPath_staticPath_volume_scaleMode_(
-        target_screen,
-        video_path,
-        static_path,
-        volume,
-        scale_mode
-    )
+    for wallpaper in wallpapers:
+        video_path = wallpaper["video_path"]
+        static_path = wallpaper.get("static_path", "")
+        volume = float(wallpaper.get("volume", 0.0))
+        scale_mode = wallpaper.get("scale_mode", "fill")
+        display_id = int(wallpaper.get("display_id") or 0)
+        
+        print(f"Starting video wallpaper:")
+        print(f"  Video: {video_path}")
+        print(f"  Static: {static_path}")
+        print(f"  Volume: {volume}")
+        print(f"  Scale: {scale_mode}")
+        print(f"  Display: {display_id}")
+        
+        # Verify video file exists
+        if not os.path.exists(video_path):
+            print(f"ERROR: Video file not found: {video_path}")
+            continue
+        
+        # Find target screen
+        target_screen = find_screen(screens, display_id)
+        if target_screen is None:
+            print(f"WARNING: Display {display_id} not found, using main screen")
+            target_screen = NSScreen.mainScreen()
+        
+        # Create video window
+        window = VideoWallpaperWindow.alloc().initWithScreen_videoPath_staticPath_volume_scaleMode_(
+            target_screen,
+            video_path,
+            static_path,
+            volume,
+            scale_mode
+        )
+        
+        if window is None:
+            print(f"ERROR: Failed to create video window for display {display_id}")
+            continue
+        
+        window.makeKeyAndOrderFront_(None)
+        windows.append(window)
     
-    if window is None:
-        print("ERROR: Failed to create video window")
+    if not windows:
+        print("ERROR: No video windows could be created")
         sys.exit(1)
     
-    window.makeKeyAndOrderFront_(None)
-    
     # Create and set delegate
-    delegate = VideoDaemonDelegate.alloc().initWithWindow_(window)
+    delegate = VideoDaemonDelegate.alloc().initWithWindows_(windows)
     app.setDelegate_(delegate)
     
     # Run application
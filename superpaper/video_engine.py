@@ -9,49 +9,55 @@ Inspired by LiveWallpaper app architecture.
 
 import os
 import sys
-import subprocess
+import json
+import functools
 import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from threading import Lock
+from threading import Event, Lock, Timer
 
 from Foundation import (
-    NSUserDefaults, NSURL,
+    NSUserDefaults, NSUserDefaultsDidChangeNotification,
+    NSNotificationCenter, NSURL, NSValue,
     CFNotificationCenterGetDarwinNotifyCenter,
     CFNotificationCenterPostNotification,
     kCFNotificationDeliverImmediately,
     kCFNotificationPostToAllSessions
 )
-from AVFoundation import AVAsset, AVAssetImageGenerator
+from AVFoundation import (
+    AVAsset, AVAssetImageGenerator, AVAssetImageGeneratorSucceeded,
+    AVKeyValueStatusLoaded
+)
 from CoreMedia import CMTimeMakeWithSeconds, CMTimeGetSeconds
-from Quartz import CGImageDestinationCreateWithURL, CGImageDestinationAddImage, CGImageDestinationFinalize, CGSizeApplyAffineTransform
+from Quartz import (
+    CGImageDestinationCreateWithURL, CGImageDestinationAddImage, CGImageDestinationFinalize,
+    CGSizeApplyAffineTransform, kCGImageDestinationLossyCompressionQuality
+)
 
 import superpaper.sp_logging as sp_logging
 import superpaper.sp_paths as sp_paths
 from superpaper.video_wallpaper_window import SPVideoWallpaperManager
 
+# Verbose daemon-launch tracing, enabled with the SP_DEBUG environment variable
+_DBG = sp_logging.get_debug_logger("engine")
+
 
 class VideoEngine:
     """
     Singleton engine for managing video wallpaper daemons.
     """
     
-    _instance = None
-    _lock = Lock()
-    
     @classmethod
+    @functools.cache
     def shared_instance(cls):
         """Get or create shared instance."""
-        if cls._instance is None:
-            with cls._lock:
-                if cls._instance is None:
-                    cls._instance = cls()
-        return cls._instance
+        inst = object.__new__(cls)
+        inst._real_init()
+        return inst
     
-    def __init__(self):
+    def _real_init(self):
         """Initialize video engine."""
-        if VideoEngine._instance is not None:
-            raise RuntimeError("Use VideoEngine.shared_instance() instead")
-        
         self.daemon_pids = []
         self.daemon_path = None
         self.static_cache_path = None
@@ -60,6 +66,36 @@ class VideoEngine:
         # Default settings
         self.default_volume = 0.0  # Muted by default
         self.default_scale_mode = "fill"  # fill, fit, stretch
+        self.static_frame_timeout = 10.0  # seconds
+        self.daemon_exit_timeout = 1.0  # seconds
+        self.volume_debounce_interval = 0.1  # seconds
+        
+        # Debounced volume updates
+        self._volume_lock = Lock()
+        self._volume_timer = None
+        self._pending_volume = None
+        
+        # video_path -> resolved static frame path, filled on cache hit or generation
+        self._existing_static = {}
+        # video_path -> Lock held while its static frame is looked up or generated
+        self._static_locks = {}
+        # Video paths already confirmed to exist
+        self._validated_videos = set()
+        
+        # Cache wallpaper settings; reloaded when the defaults change
+        self.load_settings()
+        self._defaults_observer = NSNotificationCenter.defaultCenter().addObserverForName_object_queue_usingBlock_(
+            NSUserDefaultsDidChangeNotification,
+            None,
+            None,
+            lambda notification: self.load_settings()
+        )
+    
+    def load_settings(self):
+        """Read the video wallpaper settings from UserDefaults."""
+        defaults = NSUserDefaults.standardUserDefaults()
+        self._cached_volume = defaults.floatForKey_("wallpapervolume") or self.default_volume
+        self._cached_scale = defaults.stringForKey_("scale_mode") or self.default_scale_mode
     
     def setup_paths(self):
         """Setup paths for daemon and cache."""
@@ -76,12 +112,14 @@ class VideoEngine:
         cache_base = os.path.expanduser("~/Library/Caches/Superpaper")
         self.static_cache_path = os.path.join(cache_base, "wallpapers")
         
-        # Create cache directory if needed
+        # Create cache and daemon log directories if needed
         os.makedirs(self.static_cache_path, exist_ok=True)
+        self._daemon_log_dir = os.path.join(self.static_cache_path, "logs")
+        os.makedirs(self._daemon_log_dir, exist_ok=True)
         
-        sp_logging.G_LOGGER.info(f"Video engine initialized:")
-        sp_logging.G_LOGGER.info(f"  Daemon: {self.daemon_script}")
-        sp_logging.G_LOGGER.info(f"  Cache: {self.static_cache_path}")
+        sp_logging.G_LOGGER.info("Video engine initialized:")
+        sp_logging.G_LOGGER.info("  Daemon: %s", self.daemon_script)
+        sp_logging.G_LOGGER.info("  Cache: %s", self.static_cache_path)
     
     def start_video_wallpaper(self, video_paths, display_ids):
         """
@@ -93,26 +131,30 @@ class VideoEngine:
         """
         if len(video_paths) != len(display_ids):
             sp_logging.G_LOGGER.error(
-                f"Mismatch: {len(video_paths)} videos for {len(display_ids)} displays"
+                "Mismatch: %s videos for %s displays", len(video_paths), len(display_ids)
             )
             return
         
-        # Stop existing wallpapers first
-        self.stop_video_wallpapers()
-        
         # Get settings
-        defaults = NSUserDefaults.standardUserDefaults()
-        volume = defaults.floatForKey_("wallpapervolume") or self.default_volume
-        scale_mode_str = defaults.stringForKey_("scale_mode") or self.default_scale_mode
+        volume = self._cached_volume
+        scale_mode_str = self._cached_scale
         
-        # Generate static frames for all videos
         for video_path in video_paths:
+            if video_path in self._validated_videos:
+                continue
             if not os.path.exists(video_path):
-                sp_logging.G_LOGGER.error(f"Video not found: {video_path}")
+                sp_logging.G_LOGGER.error("Video not found: %s", video_path)
                 return
-            
-            # Generate or get static frame (for quick display during transitions)
-            self.get_or_generate_static_frame(video_path)
+            self._validated_videos.add(video_path)
+        
+        # Generate or get static frames (for quick display during transitions),
+        # decoding each distinct uncached video concurrently
+        missing_static = [
+            p for p in dict.fromkeys(video_paths) if p not in self._existing_static
+        ]
+        if missing_static:
+            with ThreadPoolExecutor(max_workers=len(missing_static)) as executor:
+                list(executor.map(self.get_or_generate_static_frame, missing_static))
         
         # Start video wallpapers using SPVideoWallpaperManager
         manager = SPVideoWallpaperManager.sharedManager()
@@ -122,23 +164,25 @@ class VideoEngine:
         
         if success:
             sp_logging.G_LOGGER.info(
-                f"Started video wallpaper on {len(display_ids)} display(s)"
+                "Started video wallpaper on %s display(s)", len(display_ids)
             )
         else:
             sp_logging.G_LOGGER.error("Failed to start video wallpapers")
     
-    def launch_daemon(self, video_path, static_path, volume, scale_mode, display_id):
+    def launch_daemon(self, wallpapers):
         """
-        Launch a single video daemon process.
+        Launch a single video daemon process serving all displays.
+        
+        Args:
+            wallpapers: List of dicts with keys video_path, static_path,
+                volume, scale_mode and display_id (one per display)
         
         Returns:
             Process ID if successful, None otherwise
         """
-        # #region agent log
-        import json; log_data = {"sessionId": "debug-session", "runId": "initial", "hypothesisId": "daemon", "location": "video_engine.py:launch_daemon:135", "message": "launch_daemon: entry", "data": {"video_path": video_path, "static_path": static_path, "volume": volume, "scale_mode": scale_mode, "display_id": display_id}, "timestamp": int(__import__('time').time() * 1000)}; open("/Users/shotan/Documents/GitHub/superpaper/.cursor/debug.log", "a").write(json.dumps(log_data) + "\n")
-        # #endregion
+        _DBG.debug("launch_daemon: entry %s", wallpapers)
         if not os.path.exists(self.daemon_script):
-            sp_logging.G_LOGGER.error(f"Daemon script not found: {self.daemon_script}")
+            sp_logging.G_LOGGER.error("Daemon script not found: %s", self.daemon_script)
             return None
         
         try:
@@ -146,44 +190,41 @@ class VideoEngine:
             cmd = [
                 self.daemon_path,  # Python interpreter
                 self.daemon_script,  # video_daemon.py
-                video_path,
-                static_path,
-                str(volume),
-                scale_mode,
-                str(display_id)
+                json.dumps(wallpapers)
             ]
             
-            # #region agent log
-            import json; log_data = {"sessionId": "debug-session", "runId": "initial", "hypothesisId": "daemon", "location": "video_engine.py:launch_daemon:152", "message": "launch_daemon: before Popen", "data": {"cmd": cmd}, "timestamp": int(__import__('time').time() * 1000)}; open("/Users/shotan/Documents/GitHub/superpaper/.cursor/debug.log", "a").write(json.dumps(log_data) + "\n")
-            # #endregion
+            _DBG.debug("launch_daemon: before spawn %s", cmd)
             
-            sp_logging.G_LOGGER.info(f"Launching daemon: {' '.join(cmd)}")
+            sp_logging.G_LOGGER.info("Launching daemon: %s", cmd)
             
-            # Create log files for daemon output
-            daemon_log_dir = os.path.join(self.static_cache_path, "logs")
-            os.makedirs(daemon_log_dir, exist_ok=True)
-            daemon_log_path = os.path.join(daemon_log_dir, f"daemon_{display_id}.log")
+            # Unbuffered log file for daemon output; the child writes to it directly
+            daemon_log_path = os.path.join(self._daemon_log_dir, "daemon.log")
+            daemon_log = os.open(daemon_log_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
             
-            # Launch daemon process
-            with open(daemon_log_path, 'w') as daemon_log:
-                process = subprocess.Popen(
+            # Launch daemon process with posix_spawn, skipping fork's copy of
+            # the parent's page tables and the close_fds walk
+            try:
+                pid = os.posix_spawn(
+                    cmd[0],
                     cmd,
-                    stdout=daemon_log,
-                    stderr=subprocess.STDOUT,
-                    start_new_session=True  # Detach from parent
+                    os.environ,
+                    file_actions=[
+                        (os.POSIX_SPAWN_DUP2, daemon_log, 1),
+                        (os.POSIX_SPAWN_DUP2, daemon_log, 2)
+                    ],
+                    setsid=True  # Detach from parent
                 )
+            finally:
+                os.close(daemon_log)
             
-            # #region agent log
-            import json; log_data = {"sessionId": "debug-session", "runId": "initial", "hypothesisId": "daemon", "location": "video_engine.py:launch_daemon:167", "message": "launch_daemon: after Popen", "data": {"pid": process.pid}, "timestamp": int(__import__('time').time() * 1000)}; open("/Users/shotan/Documents/GitHub/superpaper/.cursor/debug.log", "a").write(json.dumps(log_data) + "\n")
-            # #endregion
+            _DBG.debug("launch_daemon: after spawn pid=%s", pid)
             
-            return process.pid
+            self.daemon_pids.append(pid)
+            return pid
             
         except Exception as e:
-            # #region agent log
-            import json; log_data = {"sessionId": "debug-session", "runId": "initial", "hypothesisId": "daemon", "location": "video_engine.py:launch_daemon:175", "message": "launch_daemon: exception", "data": {"exception": str(e), "exception_type": type(e).__name__}, "timestamp": int(__import__('time').time() * 1000)}; open("/Users/shotan/Documents/GitHub/superpaper/.cursor/debug.log", "a").write(json.dumps(log_data) + "\n")
-            # #endregion
-            sp_logging.G_LOGGER.error(f"Failed to launch daemon: {e}")
+            _DBG.debug("launch_daemon: exception %s: %s", type(e).__name__, e)
+            sp_logging.G_LOGGER.error("Failed to launch daemon: %s", e)
             return None
     
     def get_or_generate_static_frame(self, video_path):
@@ -194,33 +235,62 @@ class VideoEngine:
             video_path: Path to video file
             
         Returns:
-            Path to static frame PNG
+            Path to static frame JPEG
         """
+        # Frames already resolved in this process need no filesystem access
+        static_path = self._existing_static.get(video_path)
+        if static_path:
+            return static_path
+        
+        # Only one thread generates (and writes) the frame of a given video
+        with self._static_locks.setdefault(video_path, Lock()):
+            return self._existing_static.get(video_path) or self._find_or_generate_static_frame(video_path)
+    
+    def _find_or_generate_static_frame(self, video_path):
+        """Look up the static frame of a video in the disk cache, generating it if missing."""
         # Generate cache filename
-        video_name = Path(video_path).stem
-        static_path = os.path.join(self.static_cache_path, f"{video_name}.png")
+        try:
+            static_key = self._static_key(video_path)
+        except OSError as e:
+            sp_logging.G_LOGGER.error("Cannot stat video %s: %s", video_path, e)
+            return ""
+        static_path = os.path.join(self.static_cache_path, f"{static_key}.jpg")
         
         # Return if already exists
         if os.path.exists(static_path):
-            sp_logging.G_LOGGER.info(f"Using cached static frame: {static_path}")
+            sp_logging.G_LOGGER.info("Using cached static frame: %s", static_path)
+            self._existing_static[video_path] = static_path
             return static_path
         
         # Generate static frame
-        sp_logging.G_LOGGER.info(f"Generating static frame for: {video_path}")
+        sp_logging.G_LOGGER.info("Generating static frame for: %s", video_path)
         success = self.generate_static_frame(video_path, static_path)
         
         if success:
+            self._existing_static[video_path] = static_path
             return static_path
         else:
             return ""
     
-    def generate_static_frame(self, video_path, output_path):
+    def _static_key(self, video_path):
+        """
+        Cache key for a video's static frame.
+        
+        Combines the file stem with its size and mtime so that videos
+        sharing a name, or a re-encoded video, don't reuse a stale frame.
+        """
+        st = os.stat(video_path)
+        return f"{Path(video_path).stem}_{st.st_size:x}_{int(st.st_mtime):x}"
+    
+    def generate_static_frame(self, video_path, output_path, max_dim=2560):
         """
         Generate static frame from video middle point.
         
         Args:
             video_path: Path to video file
-            output_path: Path to save PNG
+            output_path: Path to save JPEG
+            max_dim: Longest side of the saved frame in pixels; larger
+                videos are scaled down
             
         Returns:
             True if successful, False otherwise
@@ -230,7 +300,20 @@ class VideoEngine:
             video_url = NSURL.fileURLWithPath_(video_path)
             asset = AVAsset.assetWithURL_(video_url)
             
-            # Wait for asset to load
+            # Load duration and tracks off this thread, then wait for them
+            loaded = Event()
+            asset.loadValuesAsynchronouslyForKeys_completionHandler_(
+                ["duration", "tracks"], loaded.set
+            )
+            if not loaded.wait(timeout=self.static_frame_timeout):
+                asset.cancelLoading()
+                sp_logging.G_LOGGER.error("Timed out loading video asset: %s", video_path)
+                return False
+            status, error = asset.statusOfValueForKey_error_("duration", None)
+            if status != AVKeyValueStatusLoaded:
+                sp_logging.G_LOGGER.error("Failed to load video asset: %s", error)
+                return False
+            
             duration = asset.duration()
             if duration.value == 0:
                 sp_logging.G_LOGGER.error("Failed to load video asset")
@@ -249,73 +332,104 @@ class VideoEngine:
                 
                 # Apply transform to get correct orientation
                 render_size = CGSizeApplyAffineTransform(natural_size, transform)
-                generator.setMaximumSize_((abs(render_size.width), abs(render_size.height)))
+                width, height = abs(render_size.width), abs(render_size.height)
+                
+                # The frame is only a startup placeholder, so cap its resolution
+                scale = min(1.0, max_dim / max(width, height))
+                generator.setMaximumSize_((width * scale, height * scale))
             
             # Generate image at midpoint
             duration_seconds = CMTimeGetSeconds(duration)
             midpoint_seconds = duration_seconds / 2.0
             midpoint_time = CMTimeMakeWithSeconds(midpoint_seconds, duration.timescale)
             
-            # Generate image synchronously
-            error = None
-            image_ref, actual_time = generator.copyCGImageAtTime_actualTime_error_(
-                midpoint_time,
-                None,
-                error
+            # Generate image asynchronously and wait for the completion handler
+            done = Event()
+            generated = {}
+            
+            def handler(requested_time, image, actual_time, result, error):
+                if result == AVAssetImageGeneratorSucceeded:
+                    generated["image"] = image
+                else:
+                    generated["error"] = error
+                done.set()
+            
+            generator.generateCGImagesAsynchronouslyForTimes_completionHandler_(
+                [NSValue.valueWithCMTime_(midpoint_time)],
+                handler
             )
+            if not done.wait(timeout=self.static_frame_timeout):
+                generator.cancelAllCGImageGeneration()
+                sp_logging.G_LOGGER.error("Timed out generating image for %s", video_path)
+                return False
             
+            image_ref = generated.get("image")
             if image_ref is None:
-                sp_logging.G_LOGGER.error(f"Failed to generate image: {error}")
+                sp_logging.G_LOGGER.error("Failed to generate image: %s", generated.get("error"))
                 return False
             
-            # Save image to PNG
+            # Save image to JPEG
             output_url = NSURL.fileURLWithPath_(output_path)
-            # Use kUTTypePNG constant or "public.png" string
             destination = CGImageDestinationCreateWithURL(
                 output_url,
-                "public.png",  # UTI string for PNG
+                "public.jpeg",  # UTI string for JPEG
                 1,
                 None
             )
             
             if destination is None:
-                sp_logging.G_LOGGER.error(f"Failed to create image destination for {output_path}")
+                sp_logging.G_LOGGER.error("Failed to create image destination for %s", output_path)
                 return False
             
-            CGImageDestinationAddImage(destination, image_ref, None)
+            CGImageDestinationAddImage(
+                destination, image_ref, {kCGImageDestinationLossyCompressionQuality: 0.9}
+            )
             success = CGImageDestinationFinalize(destination)
             
             if success:
-                sp_logging.G_LOGGER.info(f"Generated static frame: {output_path}")
+                sp_logging.G_LOGGER.info("Generated static frame: %s", output_path)
                 return True
             else:
                 sp_logging.G_LOGGER.error("Failed to finalize image")
                 return False
                 
         except Exception as e:
-            sp_logging.G_LOGGER.error(f"Error generating static frame: {e}")
+            sp_logging.G_LOGGER.error("Error generating static frame: %s", e)
             return False
     
     def kill_all_daemons(self):
         """Kill all running video daemons."""
-        # Send terminate notification
+        # A single broadcast reaches every daemon at once
         self.send_terminate_notification()
         
-        # Kill processes by PID
-        for pid in self.daemon_pids:
+        # Give daemons a short grace period to exit, then kill stragglers
+        remaining = list(self.daemon_pids)
+        deadline = time.monotonic() + self.daemon_exit_timeout
+        while remaining and time.monotonic() < deadline:
+            remaining = [pid for pid in remaining if not self._reap_daemon(pid)]
+            if remaining:
+                time.sleep(0.05)
+        
+        for pid in remaining:
             try:
-                os.kill(pid, signal.SIGTERM)
-                sp_logging.G_LOGGER.info(f"Killed daemon PID {pid}")
+                os.kill(pid, signal.SIGKILL)
+                self._reap_daemon(pid)
+                sp_logging.G_LOGGER.info("Killed unresponsive daemon PID %s", pid)
             except ProcessLookupError:
                 pass  # Process already dead
             except Exception as e:
-                sp_logging.G_LOGGER.error(f"Error killing PID {pid}: {e}")
+                sp_logging.G_LOGGER.error("Error killing PID %s: %s", pid, e)
         
         # Clear PID list
         self.daemon_pids.clear()
-        
-        # Don't use killall as it would kill the parent process too
-        # The PID-based killing above should be sufficient
+    
+    def _reap_daemon(self, pid):
+        """Return True if the daemon has exited, reaping it if possible."""
+        try:
+            reaped_pid, _ = os.waitpid(pid, os.WNOHANG)
+        except ChildProcessError:
+            return True  # Not our child anymore, or already reaped
+        return reaped_pid == pid
     
     def send_terminate_notification(self):
         """Send terminate notification to all daemons."""
@@ -330,21 +444,39 @@ class VideoEngine:
             )
             sp_logging.G_LOGGER.info("Sent terminate notification to daemons")
         except Exception as e:
-            sp_logging.G_LOGGER.error(f"Failed to send terminate notification: {e}")
+            sp_logging.G_LOGGER.error("Failed to send terminate notification: %s", e)
     
     def update_volume(self, new_volume):
         """
         Update volume for all running daemons.
         
+        Rapid successive calls (e.g. a slider drag) are coalesced: the
+        setting is saved and daemons notified once per debounce interval,
+        with the latest value.
+        
         Args:
             new_volume: Float between 0.0 and 1.0
         """
+        self._cached_volume = new_volume
+        with self._volume_lock:
+            self._pending_volume = new_volume
+            if self._volume_timer is None:
+                self._volume_timer = Timer(self.volume_debounce_interval, self._flush_volume)
+                self._volume_timer.daemon = True
+                self._volume_timer.start()
+    
+    def _flush_volume(self):
+        """Save the latest pending volume and notify daemons."""
+        with self._volume_lock:
+            new_volume = self._pending_volume
+            self._volume_timer = None
+        
         # Save to UserDefaults
         defaults = NSUserDefaults.standardUserDefaults()
         defaults.setFloat_forKey_(new_volume, "wallpapervolume")
-        defaults.synchronize()
         
-        # Send notification to daemons
+        # Daemons pick up the change from the notification; no need to
+        # force a synchronous flush to cfprefsd
         try:
             center = CFNotificationCenterGetDarwinNotifyCenter()
             CFNotificationCenterPostNotification(
@@ -354,9 +486,9 @@ class VideoEngine:
                 None,
                 kCFNotificationDeliverImmediately | kCFNotificationPostToAllSessions
             )
-            sp_logging.G_LOGGER.info(f"Updated volume to {new_volume}")
+            sp_logging.G_LOGGER.info("Updated volume to %s", new_volume)
         except Exception as e:
-            sp_logging.G_LOGGER.error(f"Failed to send volume notification: {e}")
+            sp_logging.G_LOGGER.error("Failed to send volume notification: %s", e)
     
     def cleanup(self):
         """Cleanup engine resources."""
@@ -368,4 +500,4 @@ class VideoEngine:
             manager = SPVideoWallpaperManager.sharedManager()
             manager.stopAllWallpapers()
         except Exception as e:
-            sp_logging.G_LOGGER.error(f"Error stopping video wallpapers: {e}")
+            sp_logging.G_LOGGER.error("Error stopping video wallpapers: %s", e)
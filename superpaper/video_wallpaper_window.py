@@ -5,11 +5,16 @@ Manages video wallpaper windows in the main application process.
 Based on LiveWallpaperMacOS architecture.
 """
 
+import logging
 import os
+
+import numpy as np
 from Foundation import (
-    NSObject, NSURL, NSUserDefaults, NSScreen, NSRunLoop,
+    NSObject, NSURL, NSUserDefaults, NSScreen, NSRunLoop, NSOperationQueue,
     NSDefaultRunLoopMode, NSRunLoopCommonModes, NSTimer,
-    NSNotificationCenter, NSWorkspace
+    NSNotificationCenter, NSWorkspace,
+    NSKeyValueObservingOptionInitial, NSKeyValueObservingOptionNew,
+    NSMakeSize
 )
 from AppKit import (
     NSWindow, NSWindowStyleMaskBorderless, NSBackingStoreBuffered,
@@ -20,15 +25,269 @@ from AppKit import (
     NSColor, NSWindowSharingNone
 )
 from AVFoundation import (
-    AVAsset, AVPlayerItem, AVQueuePlayer, AVPlayerLooper, AVPlayerLayer,
+    AVURLAsset, AVURLAssetPreferPreciseDurationAndTimingKey, AVKeyValueStatusLoaded,
+    AVPlayerItem, AVPlayerItemStatusUnknown, AVPlayerItemStatusReadyToPlay,
+    AVPlayerItemDidPlayToEndTimeNotification, AVPlayer, AVPlayerActionAtItemEndNone, AVPlayerLayer,
+    AVAssetReader, AVAssetReaderTrackOutput, AVAssetReaderStatusCompleted,
+    AVSampleBufferDisplayLayer, AVMediaTypeVideo, AVMediaTypeAudio,
+    AVMutableAudioMix, AVMutableAudioMixInputParameters,
     AVLayerVideoGravityResizeAspectFill, AVLayerVideoGravityResizeAspect,
     AVLayerVideoGravityResize
 )
-from Quartz import CGWindowLevelForKey, kCGDesktopWindowLevelKey, CGDisplayBounds
+from CoreMedia import (
+    CMClockGetHostTimeClock, CMTimebaseCreateWithSourceClock,
+    CMTimebaseSetRate, CMTimebaseSetTime, kCMTimeZero,
+    CMTimeAdd, CMTimeSubtract, CMTimeMaximum,
+    CMSampleTimingInfo, CMSampleBufferCreateCopyWithNewTiming,
+    CMSampleBufferGetPresentationTimeStamp, CMSampleBufferGetDecodeTimeStamp,
+    CMSampleBufferGetDuration
+)
+from Quartz import (
+    CATransaction, CGWindowLevelForKey, kCGDesktopWindowLevelKey, CGDisplayBounds,
+    CGAffineTransformIsIdentity, CGSizeApplyAffineTransform
+)
+from libdispatch import dispatch_queue_create
+import objc
 from objc import super as objc_super
 import superpaper.sp_logging as sp_logging
 
 
+# Verbose setup/teardown tracing, enabled with the SP_DEBUG environment variable
+_DBG = sp_logging.get_debug_logger("vww")
+
+
+# Window level just below the desktop icons and the behavior of wallpaper windows
+_DESKTOP_LEVEL = CGWindowLevelForKey(kCGDesktopWindowLevelKey) - 1
+_COLLECTION_BEHAVIOR = (
+    NSWindowCollectionBehaviorCanJoinAllSpaces |
+    NSWindowCollectionBehaviorFullScreenAuxiliary |
+    NSWindowCollectionBehaviorStationary |
+    NSWindowCollectionBehaviorIgnoresCycle
+)
+
+# Layer video gravity for each scale mode
+_GRAVITY = {
+    "fill": AVLayerVideoGravityResizeAspectFill,
+    "fit": AVLayerVideoGravityResizeAspect,
+    "stretch": AVLayerVideoGravityResize,
+}
+
+# Concurrent queue for the non-UI part of player setup
+_SETUP_QUEUE = NSOperationQueue.alloc().init()
+_SETUP_QUEUE.setName_("sp.vww.setup")
+
+
+def _debug_log_screens(all_ns_screens):
+    """Log the index, number and frame of every available screen."""
+    for idx, ns_screen in enumerate(all_ns_screens):
+        _DBG.debug(
+            "screen index=%s number=%s frame=%s",
+            idx, ns_screen.deviceDescription().get("NSScreenNumber"), ns_screen.frame()
+        )
+
+
+def _load_asset(video_path, completion):
+    """
+    Asynchronously open a video file.
+    
+    The asset is created and its keys loaded off the main thread, then
+    completion(asset) is called on the main thread. On failure
+    completion is called with None.
+    """
+    def loaded(asset):
+        status, error = asset.statusOfValueForKey_error_("tracks", None)
+        if status != AVKeyValueStatusLoaded or not asset.isPlayable():
+            sp_logging.G_LOGGER.error(f"Failed to load video asset {video_path}: {error}")
+            completion(None)
+            return
+        completion(asset)
+    
+    def load_asset():
+        try:
+            video_url = NSURL.fileURLWithPath_(video_path)
+            # Precise duration would force a full-file scan before the asset opens
+            asset = AVURLAsset.URLAssetWithURL_options_(
+                video_url, {AVURLAssetPreferPreciseDurationAndTimingKey: False}
+            )
+        except (ValueError, objc.error):
+            # Paths that cannot be encoded for Foundation
+            sp_logging.G_LOGGER.exception(f"Failed to open video {video_path}")
+            asset = None
+        if asset is None:
+            NSOperationQueue.mainQueue().addOperationWithBlock_(lambda: completion(None))
+            return
+        asset.loadValuesAsynchronouslyForKeys_completionHandler_(
+            ["playable", "tracks"],
+            lambda: NSOperationQueue.mainQueue().addOperationWithBlock_(
+                lambda: loaded(asset)
+            )
+        )
+    
+    # Even creating the URL and asset is kept off the main thread
+    _SETUP_QUEUE.addOperationWithBlock_(load_asset)
+
+
+def _load_looping_player(video_path, volume, max_size, completion):
+    """
+    Asynchronously create a looping player for a video file playing at volume.
+    
+    max_size is the largest size in pixels the video is displayed at.
+    
+    The player item and player are created on the main thread once the
+    asset has loaded and passed to completion(player, loop_observer).
+    On failure completion is called with (None, None).
+    
+    loop_observer must be removed with _stop_looping when the player
+    is no longer needed.
+    """
+    def create_player(asset):
+        if asset is None:
+            completion(None, None)
+            return
+        completion(*_create_looping_player(asset, volume, max_size))
+    
+    _load_asset(video_path, create_player)
+
+
+def _create_looping_player(asset, volume, max_size):
+    """
+    Create a (player, loop_observer) pair looping over a loaded asset at volume.
+    
+    max_size (pixels) lets AVFoundation pick the smallest sufficient
+    variant of the video.
+    
+    A wallpaper does not need gapless looping, so instead of an
+    AVPlayerLooper, which keeps several copies of the item prerolled,
+    the single item is rewound whenever it reaches its end.
+    """
+    item = AVPlayerItem.playerItemWithAsset_(asset)
+    # A local file is cheap to re-read, so keep only a second buffered ahead
+    item.setPreferredForwardBufferDuration_(1.0)
+    item.setPreferredPeakBitRate_(0)
+    item.setPreferredMaximumResolution_(max_size)
+    if volume <= 0:
+        # Silence every audio track so no audio render pipeline is set up
+        audio_mix = AVMutableAudioMix.audioMix()
+        input_parameters = []
+        for track in asset.tracksWithMediaType_(AVMediaTypeAudio):
+            parameters = AVMutableAudioMixInputParameters.audioMixInputParametersWithTrack_(track)
+            parameters.setVolume_atTime_(0.0, kCMTimeZero)
+            input_parameters.append(parameters)
+        audio_mix.setInputParameters_(input_parameters)
+        item.setAudioMix_(audio_mix)
+    player = AVPlayer.playerWithPlayerItem_(item)
+    player.setActionAtItemEnd_(AVPlayerActionAtItemEndNone)
+    
+    def rewind(notification):
+        player.seekToTime_(kCMTimeZero)
+        player.play()
+    
+    loop_observer = NSNotificationCenter.defaultCenter().addObserverForName_object_queue_usingBlock_(
+        AVPlayerItemDidPlayToEndTimeNotification, item, NSOperationQueue.mainQueue(), rewind
+    )
+    _apply_volume(player, volume)
+    return player, loop_observer
+
+
+def _stop_looping(loop_observer):
+    """Remove a loop observer returned by _create_looping_player."""
+    NSNotificationCenter.defaultCenter().removeObserver_(loop_observer)
+
+
+def _apply_volume(player, volume):
+    """Set the player volume, keeping it muted when silent."""
+    if volume > 0:
+        player.setVolume_(volume)
+        player.setMuted_(False)
+    else:
+        player.setMuted_(True)
+
+
+# Observed on a player's only item to start it once the item is ready
+_ITEM_STATUS_KEY_PATH = "status"
+
+
+def _observe_item_status(observer, player):
+    """Have observer notified of the status of the player's item, starting with the current one."""
+    player.currentItem().addObserver_forKeyPath_options_context_(
+        observer, _ITEM_STATUS_KEY_PATH,
+        NSKeyValueObservingOptionInitial | NSKeyValueObservingOptionNew,
+        None
+    )
+
+
+def _play_when_ready(observer, player):
+    """
+    Handle an item status change observed with _observe_item_status.
+    
+    Plays the player once its current item is ready and stops observing
+    as soon as the status is final.
+    
+    Returns:
+        True if observing has stopped, False while still waiting
+    """
+    item = player.currentItem()
+    status = item.status()
+    if status == AVPlayerItemStatusUnknown:
+        return False
+    item.removeObserver_forKeyPath_(observer, _ITEM_STATUS_KEY_PATH)
+    if status == AVPlayerItemStatusReadyToPlay:
+        player.play()
+    else:
+        sp_logging.G_LOGGER.error(f"Video player item failed: {item.error()}")
+    return True
+
+
+def _create_track_reader(asset, track):
+    """
+    Create a started AVAssetReader reading the compressed samples of a video track.
+    
+    The display layer decodes them itself, so no decoded frames are queued.
+    
+    Returns:
+        Tuple (reader, output), or (None, None) if reading could not start
+    """
+    reader, error = AVAssetReader.assetReaderWithAsset_error_(asset, None)
+    if reader is None:
+        sp_logging.G_LOGGER.error(f"Failed to create asset reader: {error}")
+        return None, None
+    output = AVAssetReaderTrackOutput.assetReaderTrackOutputWithTrack_outputSettings_(track, None)
+    # Samples go straight to the display layer, which does not modify them
+    output.setAlwaysCopiesSampleData_(False)
+    reader.addOutput_(output)
+    if not reader.startReading():
+        sp_logging.G_LOGGER.error(f"Failed to start asset reader: {reader.error()}")
+        return None, None
+    return reader, output
+
+
+def _offset_sample(sample, offset):
+    """Return a copy of sample with its timestamps moved later by offset."""
+    timing = CMSampleTimingInfo(
+        CMSampleBufferGetDuration(sample),
+        CMTimeAdd(CMSampleBufferGetPresentationTimeStamp(sample), offset),
+        CMTimeAdd(CMSampleBufferGetDecodeTimeStamp(sample), offset)
+    )
+    _, shifted = CMSampleBufferCreateCopyWithNewTiming(None, sample, 1, [timing], None)
+    return shifted
+
+
+def _screen_key(screen):
+    """Identify a screen and its current placement, to notice display changes."""
+    frame = screen.frame()
+    return (
+        screen.deviceDescription().get("NSScreenNumber"),
+        frame.origin.x, frame.origin.y, frame.size.width, frame.size.height
+    )
+
+
+def _screen_pixel_size(screen):
+    """Size of the screen in pixels."""
+    frame_size = screen.frame().size
+    scale = screen.backingScaleFactor()
+    return NSMakeSize(frame_size.width * scale, frame_size.height * scale)
+
+
 class SPVideoWallpaperWindow(NSObject):
     """
     Video wallpaper window that plays video on the desktop.
@@ -55,6 +314,29 @@ class SPVideoWallpaperWindow(NSObject):
             return instance
         return None
     
+    @classmethod
+    def createWithSharedPlayer_screen_scaleMode_cropRect_(cls, player, screen, scale_mode, crop_rect):
+        """
+        Factory method to create a window showing part of a shared player.
+        
+        The window only displays the player; its owner is responsible
+        for playback and for releasing it.
+        
+        Args:
+            player: AVPlayer shared between several windows, or None to
+                attach it later with setSharedPlayer_
+            screen: NSScreen object for target display
+            scale_mode: Scaling mode ('fill', 'fit', 'stretch')
+            crop_rect: Tuple (x, y, width, height) as normalized coordinates (0.0-1.0) for cropping
+        
+        Returns:
+            SPVideoWallpaperWindow instance or None if failed
+        """
+        instance = cls.alloc().init()
+        if instance.setupWithSharedPlayer_screen_scaleMode_cropRect_(player, screen, scale_mode, crop_rect):
+            return instance
+        return None
+    
     def init(self):
         """Initialize the window."""
         self = objc_super(SPVideoWallpaperWindow, self).init()
@@ -64,8 +346,18 @@ class SPVideoWallpaperWindow(NSObject):
         self.window = None
         self.player = None
         self.player_layer = None
-        self.looper = None
+        self.loop_observer = None
         self.target_screen = None
+        # Size of the spanned canvas the layer is laid out to, in points
+        self.canvas_size = None
+        self.scale_mode = None
+        self.observing_status = False
+        # Silent playback feeds samples straight into a display layer; the
+        # state is shared with the decode queue, only the main thread cancels it
+        self.decode_state = None
+        self.decode_queue = None
+        # What the manager asked this window to show, used to skip unchanged displays
+        self.wallpaper_key = None
         
         return self
     
@@ -84,195 +376,342 @@ class SPVideoWallpaperWindow(NSObject):
             True if successful, False otherwise
         """
         try:
-            # #region agent log
-            import json; log_data = {"sessionId": "debug-session", "runId": "setup", "hypothesisId": "H1,H4,H5", "location": "video_wallpaper_window.py:setupWithVideo:entry", "message": "Setup entry", "data": {"video_path": video_path, "video_exists": os.path.exists(video_path), "file_size_mb": os.path.getsize(video_path) / (1024*1024) if os.path.exists(video_path) else 0}, "timestamp": int(__import__('time').time() * 1000)}; open("/Users/shotan/Documents/GitHub/superpaper/.cursor/debug.log", "a").write(json.dumps(log_data) + "\n")
-            # #endregion
-            
-            if not os.path.exists(video_path):
-                sp_logging.G_LOGGER.error(f"Video file not found: {video_path}")
-                return False
-            
-            self.target_screen = screen
-            video_url = NSURL.fileURLWithPath_(video_path)
-            visible_frame = screen.frame()
-            
-            # #region agent log
-            import json; log_data = {"sessionId": "debug-session", "runId": "setup", "hypothesisId": "H1", "location": "video_wallpaper_window.py:setupWithVideo:url_created", "message": "Video URL created", "data": {"url": str(video_url)}, "timestamp": int(__import__('time').time() * 1000)}; open("/Users/shotan/Documents/GitHub/superpaper/.cursor/debug.log", "a").write(json.dumps(log_data) + "\n")
-            # #endregion
-            
-            # Create borderless window
-            self.window = NSWindow.alloc().initWithContentRect_styleMask_backing_defer_screen_(
-                visible_frame,
-                NSWindowStyleMaskBorderless,
-                NSBackingStoreBuffered,
-                False,
-                screen
+            st = os.stat(video_path)
+        except OSError:
+            sp_logging.G_LOGGER.error(f"Video file not found: {video_path}")
+            return False
+        file_size_mb = st.st_size / (1024 * 1024)
+        
+        if _DBG.isEnabledFor(logging.DEBUG):
+            _DBG.debug("setup:entry video=%s size=%.1fMB", video_path, file_size_mb)
+        
+        self.target_screen = screen
+        if not self.setupWindowOnScreen_(screen):
+            return False
+        
+        # Show the window right away; the video is attached once the
+        # asset has loaded
+        if volume == 0:
+            # Without audio the AVPlayer pipeline is not needed
+            self.attachLayer_scaleMode_cropRect_(
+                AVSampleBufferDisplayLayer.alloc().init(), scale_mode, crop_rect
             )
-            
-            # Set window to desktop level
-            desktop_level = CGWindowLevelForKey(kCGDesktopWindowLevelKey)
-            self.window.setLevel_(desktop_level - 1)
-            
-            # Configure window behavior
-            self.window.setCollectionBehavior_(
-                NSWindowCollectionBehaviorCanJoinAllSpaces |
-                NSWindowCollectionBehaviorFullScreenAuxiliary |
-                NSWindowCollectionBehaviorStationary |
-                NSWindowCollectionBehaviorIgnoresCycle
+            _load_asset(video_path, self.startDecodingAsset_)
+        else:
+            self.attachPlayer_scaleMode_cropRect_(None, scale_mode, crop_rect)
+            _load_looping_player(
+                video_path, volume, _screen_pixel_size(screen), self.startPlayer_loopObserver_
             )
-            
-            self.window.setOpaque_(False)
-            self.window.setBackgroundColor_(NSColor.clearColor())
-            self.window.setHasShadow_(False)
-            self.window.contentView().setWantsLayer_(True)
-            self.window.setSharingType_(NSWindowSharingNone)
-            self.window.setIgnoresMouseEvents_(True)
-            
-            # Create AVPlayer with looper
-            # #region agent log
-            import json; log_data = {"sessionId": "debug-session", "runId": "setup", "hypothesisId": "H1,H4", "location": "video_wallpaper_window.py:setupWithVideo:before_asset", "message": "Before creating AVAsset", "data": {}, "timestamp": int(__import__('time').time() * 1000)}; open("/Users/shotan/Documents/GitHub/superpaper/.cursor/debug.log", "a").write(json.dumps(log_data) + "\n")
-            # #endregion
-            
-            asset = AVAsset.assetWithURL_(video_url)
-            
-            # #region agent log
-            import json; log_data = {"sessionId": "debug-session", "runId": "setup", "hypothesisId": "H1,H4", "location": "video_wallpaper_window.py:setupWithVideo:asset_created", "message": "AVAsset created", "data": {}, "timestamp": int(__import__('time').time() * 1000)}; open("/Users/shotan/Documents/GitHub/superpaper/.cursor/debug.log", "a").write(json.dumps(log_data) + "\n")
-            # #endregion
-            
-            item = AVPlayerItem.playerItemWithAsset_(asset)
-            
-            # #region agent log
-            import json; log_data = {"sessionId": "debug-session", "runId": "setup", "hypothesisId": "H1,H4", "location": "video_wallpaper_window.py:setupWithVideo:item_created", "message": "AVPlayerItem created", "data": {}, "timestamp": int(__import__('time').time() * 1000)}; open("/Users/shotan/Documents/GitHub/superpaper/.cursor/debug.log", "a").write(json.dumps(log_data) + "\n")
-            # #endregion
-            
-            self.player = AVQueuePlayer.queuePlayerWithItems_([])
-            
-            # #region agent log
-            import json; log_data = {"sessionId": "debug-session", "runId": "setup", "hypothesisId": "H1,H4", "location": "video_wallpaper_window.py:setupWithVideo:player_created", "message": "AVQueuePlayer created", "data": {}, "timestamp": int(__import__('time').time() * 1000)}; open("/Users/shotan/Documents/GitHub/superpaper/.cursor/debug.log", "a").write(json.dumps(log_data) + "\n")
-            # #endregion
-            
-            self.looper = AVPlayerLooper.playerLooperWithPlayer_templateItem_(
-                self.player, item
+        
+        sp_logging.G_LOGGER.info(f"Video wallpaper window created for screen {screen}")
+        return True
+    
+    def startPlayer_loopObserver_(self, player, loop_observer):
+        """Attach the loaded player to the layer and start playback."""
+        if player is None:
+            return  # Loading failed
+        if self.window is None:
+            _stop_looping(loop_observer)
+            return  # The window was cleaned up meanwhile
+        self.player = player
+        self.loop_observer = loop_observer
+        self.player_layer.setPlayer_(player)
+        
+        # Playback starts once the first item is ready
+        self.observing_status = True
+        _observe_item_status(self, self.player)
+    
+    def hasStartedVideo(self):
+        """Whether the video was loaded and attached to this window."""
+        return self.player is not None or self.decode_state is not None
+    
+    def observeValueForKeyPath_ofObject_change_context_(self, key_path, obj, change, context):
+        """Start playback once the player's item becomes ready to play."""
+        if key_path != _ITEM_STATUS_KEY_PATH or not self.observing_status:
+            return
+        if _play_when_ready(self, self.player):
+            self.observing_status = False
+    
+    def startDecodingAsset_(self, asset):
+        """
+        Feed the video track into the display layer, looping at the end.
+        
+        Samples are read on a serial background queue whenever the layer
+        wants more data. At the end of the track a new reader is started
+        on the same track and its samples are shifted to follow the
+        previous pass, so the layer plays every pass through to its end.
+        """
+        if asset is None or self.window is None:
+            return  # Loading failed, or the window was cleaned up meanwhile
+        tracks = asset.tracksWithMediaType_(AVMediaTypeVideo)
+        if not tracks:
+            sp_logging.G_LOGGER.error("Video asset has no video track")
+            return
+        track = tracks[0]
+        
+        if not CGAffineTransformIsIdentity(track.preferredTransform()):
+            # The display layer ignores the track's rotation; AVPlayerLayer applies it
+            self.player_layer.removeFromSuperlayer()
+            self.attachPlayer_scaleMode_cropRect_(None, self.scale_mode, self.crop_info)
+            self.startPlayer_loopObserver_(
+                *_create_looping_player(asset, 0, _screen_pixel_size(self.target_screen))
             )
-            
-            # #region agent log
-            import json; log_data = {"sessionId": "debug-session", "runId": "setup", "hypothesisId": "H1,H4", "location": "video_wallpaper_window.py:setupWithVideo:looper_created", "message": "AVPlayerLooper created", "data": {}, "timestamp": int(__import__('time').time() * 1000)}; open("/Users/shotan/Documents/GitHub/superpaper/.cursor/debug.log", "a").write(json.dumps(log_data) + "\n")
-            # #endregion
-            
-            # Create and configure player layer
-            self.player_layer = AVPlayerLayer.playerLayerWithPlayer_(self.player)
-            
-            # For spanning: set video gravity to fill and disable cropping
-            # We'll use a different approach - scale the layer to canvas size and offset it
-            self.player_layer.setVideoGravity_(AVLayerVideoGravityResizeAspectFill)
-            
-            # Store crop info for later use
-            self.crop_info = crop_rect
-            
-            if crop_rect is not None:
-                # Spanning mode: scale player layer to entire canvas size
-                # and position it so the correct portion shows in this window
-                from Quartz import CGRectMake
-                x_norm, y_norm, width_norm, height_norm = crop_rect
-                
-                # Get window bounds
-                window_bounds = self.window.contentView().bounds()
-                window_width = window_bounds.size.width
-                window_height = window_bounds.size.height
-                
-                # Calculate canvas size from normalized crop dimensions
-                # window_width = canvas_width * width_norm
-                canvas_width = window_width / width_norm if width_norm > 0 else window_width
-                canvas_height = window_height / height_norm if height_norm > 0 else window_height
-                
-                # Calculate offset - where to position the canvas within this window
-                # The portion at (x_norm, y_norm) of the canvas should be at (0, 0) of the window
-                offset_x = -x_norm * canvas_width
-                offset_y = -y_norm * canvas_height
-                
-                # Set player layer frame to full canvas size, positioned with offset
-                layer_frame = CGRectMake(offset_x, offset_y, canvas_width, canvas_height)
-                self.player_layer.setFrame_(layer_frame)
-                
-                # Enable clipping to window bounds
-                self.window.contentView().layer().setMasksToBounds_(True)
-                
-                # #region agent log
-                import json; log_data = {"sessionId": "debug-session", "runId": "span", "hypothesisId": "H9_FIX", "location": "video_wallpaper_window.py:setupWithVideo:layer_transform", "message": "Applied layer scaling and offset", "data": {"crop_x": float(x_norm), "crop_y": float(y_norm), "crop_w": float(width_norm), "crop_h": float(height_norm), "window_w": float(window_width), "window_h": float(window_height), "canvas_w": float(canvas_width), "canvas_h": float(canvas_height), "offset_x": float(offset_x), "offset_y": float(offset_y)}, "timestamp": int(__import__('time').time() * 1000)}; open("/Users/shotan/Documents/GitHub/superpaper/.cursor/debug.log", "a").write(json.dumps(log_data) + "\n")
-                # #endregion
+            return
+        
+        reader, output = _create_track_reader(asset, track)
+        if reader is None:
+            return
+        
+        # Present samples by their timestamps, driven by the host clock;
+        # the clock starts at the first sample once it is read
+        _, timebase = CMTimebaseCreateWithSourceClock(None, CMClockGetHostTimeClock(), None)
+        CMTimebaseSetRate(timebase, 0.0)
+        
+        layer = self.player_layer
+        layer.setControlTimebase_(timebase)
+        self.decode_queue = dispatch_queue_create(b"sp.vww.decode.%d" % id(self), None)
+        state = self.decode_state = {
+            "reader": reader, "output": output, "cancelled": False,
+            # Shift of the current pass (None for the first one) and end of
+            # the latest enqueued sample
+            "offset": None, "end": kCMTimeZero, "first_pts": None,
+        }
+        
+        def enqueue_samples():
+            while layer.isReadyForMoreMediaData():
+                if state["cancelled"]:
+                    return
+                sample = state["output"].copyNextSampleBuffer()
+                if sample is not None:
+                    if state["first_pts"] is None:
+                        state["first_pts"] = CMSampleBufferGetPresentationTimeStamp(sample)
+                        CMTimebaseSetTime(timebase, state["first_pts"])
+                        CMTimebaseSetRate(timebase, 1.0)
+                    if state["offset"] is not None:
+                        sample = _offset_sample(sample, state["offset"])
+                    state["end"] = CMTimeMaximum(state["end"], CMTimeAdd(
+                        CMSampleBufferGetPresentationTimeStamp(sample),
+                        CMSampleBufferGetDuration(sample)
+                    ))
+                    layer.enqueueSampleBuffer_(sample)
+                    continue
+                if state["reader"].status() != AVAssetReaderStatusCompleted:
+                    return  # Cancelled by cleanup, or decoding failed
+                if state["first_pts"] is None:
+                    layer.stopRequestingMediaData()
+                    return  # The track has no samples to loop
                 
-                sp_logging.G_LOGGER.info(f"Applied layer transform: canvas={canvas_width:.0f}x{canvas_height:.0f}, offset=({offset_x:.0f},{offset_y:.0f})")
-            else:
-                # Non-spanning mode: just fill the window
-                self.player_layer.setFrame_(self.window.contentView().bounds())
-            
-            self.window.contentView().layer().addSublayer_(self.player_layer)
-            
-            # Set window frame and show
-            self.window.setFrame_display_(visible_frame, True)
-            self.window.makeKeyAndOrderFront_(None)
-            
-            # #region agent log
-            import json; log_data = {"sessionId": "debug-session", "runId": "setup", "hypothesisId": "H4", "location": "video_wallpaper_window.py:setupWithVideo:before_play", "message": "Before player.play()", "data": {}, "timestamp": int(__import__('time').time() * 1000)}; open("/Users/shotan/Documents/GitHub/superpaper/.cursor/debug.log", "a").write(json.dumps(log_data) + "\n")
-            # #endregion
-            
-            # Configure and start playback
-            self.player.setVolume_(volume)
-            self.player.setMuted_(False)
-            self.player.play()
-            
-            # #region agent log
-            import json; log_data = {"sessionId": "debug-session", "runId": "setup", "hypothesisId": "H4", "location": "video_wallpaper_window.py:setupWithVideo:after_play", "message": "After player.play()", "data": {}, "timestamp": int(__import__('time').time() * 1000)}; open("/Users/shotan/Documents/GitHub/superpaper/.cursor/debug.log", "a").write(json.dumps(log_data) + "\n")
-            # #endregion
-            
-            sp_logging.G_LOGGER.info(f"Video wallpaper window created for screen {screen}")
-            return True
-            
-        except Exception as e:
-            sp_logging.G_LOGGER.error(f"Failed to setup video wallpaper window: {e}")
-            import traceback
-            traceback.print_exc()
+                # End of track: queue the next pass right after this one
+                reader, output = _create_track_reader(asset, track)
+                if reader is None:
+                    layer.stopRequestingMediaData()
+                    return
+                state["reader"], state["output"] = reader, output
+                state["offset"] = CMTimeSubtract(state["end"], state["first_pts"])
+                if state["cancelled"]:
+                    # Cleanup ran while the reader was created
+                    reader.cancelReading()
+                    return
+        
+        layer.requestMediaDataWhenReadyOnQueue_usingBlock_(self.decode_queue, enqueue_samples)
+    
+    def setupWithSharedPlayer_screen_scaleMode_cropRect_(self, player, screen, scale_mode, crop_rect):
+        """
+        Setup wallpaper showing a player owned elsewhere.
+        
+        Args:
+            player: Shared AVPlayer, or None to attach it later
+            screen: NSScreen object
+            scale_mode: Scaling mode
+            crop_rect: Tuple (x, y, width, height) as normalized coordinates (0.0-1.0) for cropping, or None for full video
+        
+        Returns:
+            True if successful, False otherwise
+        """
+        self.target_screen = screen
+        if not self.setupWindowOnScreen_(screen):
+            return False
+        self.attachPlayer_scaleMode_cropRect_(None, scale_mode, crop_rect)
+        if player is not None:
+            self.setSharedPlayer_(player)
+        
+        sp_logging.G_LOGGER.info(f"Shared video wallpaper window created for screen {screen}")
+        return True
+    
+    def setSharedPlayer_(self, player):
+        """Display a player owned elsewhere in this window."""
+        self.player_layer.setPlayer_(player)
+    
+    def setupWindowOnScreen_(self, screen):
+        """
+        Create the borderless desktop-level window covering the screen.
+        
+        Returns:
+            True if the window was created, False otherwise
+        """
+        visible_frame = screen.frame()
+        
+        # Create borderless window
+        self.window = NSWindow.alloc().initWithContentRect_styleMask_backing_defer_screen_(
+            visible_frame,
+            NSWindowStyleMaskBorderless,
+            NSBackingStoreBuffered,
+            False,
+            screen
+        )
+        if self.window is None:
+            sp_logging.G_LOGGER.error(f"Failed to create window for screen {screen}")
             return False
+        
+        # Set window to desktop level
+        self.window.setLevel_(_DESKTOP_LEVEL)
+        
+        # Configure window behavior
+        self.window.setCollectionBehavior_(_COLLECTION_BEHAVIOR)
+        
+        self.window.setOpaque_(False)
+        self.window.setBackgroundColor_(NSColor.clearColor())
+        self.window.setHasShadow_(False)
+        self.window.contentView().setWantsLayer_(True)
+        self.window.setSharingType_(NSWindowSharingNone)
+        self.window.setIgnoresMouseEvents_(True)
+        return True
+    
+    def attachPlayer_scaleMode_cropRect_(self, player, scale_mode, crop_rect):
+        """
+        Add a layer displaying the player (or the crop_rect part of it) and show the window.
+        
+        player may be None and set on the layer once it is available.
+        """
+        self.attachLayer_scaleMode_cropRect_(AVPlayerLayer.playerLayerWithPlayer_(player), scale_mode, crop_rect)
+    
+    def attachLayer_scaleMode_cropRect_(self, layer, scale_mode, crop_rect):
+        """
+        Add a video layer showing the video (or the crop_rect part of it) and show the window.
+        
+        layer is an AVPlayerLayer or an AVSampleBufferDisplayLayer.
+        """
+        self.player_layer = layer
+        self.scale_mode = scale_mode
+        
+        # Store crop info for later use
+        self.crop_info = crop_rect
+        
+        if crop_rect is not None:
+            # Spanning mode: the layer frame is the exact canvas region, so the
+            # video is stretched to it and scale_mode is applied to the canvas
+            self.player_layer.setVideoGravity_(AVLayerVideoGravityResize)
+            self.layoutCanvasForVideoSize_(None)
+            
+            # Enable clipping to window bounds
+            self.window.contentView().layer().setMasksToBounds_(True)
+        else:
+            # Non-spanning mode: the layer covers the window
+            self.player_layer.setVideoGravity_(_GRAVITY.get(scale_mode, AVLayerVideoGravityResizeAspectFill))
+            self.player_layer.setFrame_(self.window.contentView().bounds())
+        
+        self.window.contentView().layer().addSublayer_(self.player_layer)
+        
+        # The window was created with the screen frame already; showing it
+        # performs the initial display
+        self.window.makeKeyAndOrderFront_(None)
+    
+    def layoutCanvasForVideoSize_(self, video_size):
+        """
+        Scale the layer to the entire canvas and offset it so this window shows its crop_info part.
+        
+        Args:
+            video_size: Natural size of the video, or None if not known yet.
+                When given and scale_mode is not 'stretch', the canvas is
+                fitted to the video's aspect ratio: grown on its shorter axis
+                for 'fill', shrunk on its longer axis for 'fit'.
+        """
+        from Quartz import CGRectMake
+        x_norm, y_norm, width_norm, height_norm = self.crop_info
+        
+        # Get window bounds
+        window_bounds = self.window.contentView().bounds()
+        window_width = window_bounds.size.width
+        window_height = window_bounds.size.height
+        
+        # Calculate canvas size from normalized crop dimensions
+        # window_width = canvas_width * width_norm
+        canvas_width = window_width / width_norm if width_norm > 0 else window_width
+        canvas_height = window_height / height_norm if height_norm > 0 else window_height
+        
+        # Calculate offset - where to position the canvas within this window
+        # The portion at (x_norm, y_norm) of the canvas should be at (0, 0) of the window
+        offset_x = -x_norm * canvas_width
+        offset_y = -y_norm * canvas_height
+        
+        gravity = _GRAVITY.get(self.scale_mode, AVLayerVideoGravityResizeAspectFill)
+        if (gravity != AVLayerVideoGravityResize and video_size is not None
+                and video_size.width > 0 and video_size.height > 0):
+            video_aspect = video_size.width / video_size.height
+            wider = canvas_width / canvas_height > video_aspect
+            if wider == (gravity == AVLayerVideoGravityResizeAspectFill):
+                # Fill a wider canvas, or fit a taller one: adjust the height, centered
+                new_height = canvas_width / video_aspect
+                offset_y -= (new_height - canvas_height) / 2
+                canvas_height = new_height
+            else:
+                # Fill a taller canvas, or fit a wider one: adjust the width, centered
+                new_width = canvas_height * video_aspect
+                offset_x -= (new_width - canvas_width) / 2
+                canvas_width = new_width
+        
+        # Set player layer frame to full canvas size, positioned with offset
+        self.player_layer.setFrame_(CGRectMake(offset_x, offset_y, canvas_width, canvas_height))
+        self.canvas_size = NSMakeSize(canvas_width, canvas_height)
+        
+        if _DBG.isEnabledFor(logging.DEBUG):
+            _DBG.debug("setup:layer_transform crop=%s canvas=(%s, %s) offset=(%s, %s)", self.crop_info, canvas_width, canvas_height, offset_x, offset_y)
+        
+        sp_logging.G_LOGGER.info(f"Applied layer transform: canvas={canvas_width:.0f}x{canvas_height:.0f}, offset=({offset_x:.0f},{offset_y:.0f})")
     
     def cleanup(self):
         """Cleanup and close the window."""
-        # #region agent log
-        import json; log_data = {"sessionId": "debug-session", "runId": "cleanup", "hypothesisId": "H2", "location": "video_wallpaper_window.py:cleanup:entry", "message": "Starting cleanup", "data": {"has_player": self.player is not None, "has_window": self.window is not None}, "timestamp": int(__import__('time').time() * 1000)}; open("/Users/shotan/Documents/GitHub/superpaper/.cursor/debug.log", "a").write(json.dumps(log_data) + "\n")
-        # #endregion
+        self.tearDown()
+        self.closeWindow()
+    
+    def tearDown(self):
+        """Stop playback, hide the window and detach its layer, leaving the window to closeWindow."""
+        if _DBG.isEnabledFor(logging.DEBUG):
+            _DBG.debug("cleanup:entry has_player=%s has_window=%s", self.player is not None, self.window is not None)
         
         if self.player:
+            if self.observing_status:
+                self.player.currentItem().removeObserver_forKeyPath_(self, _ITEM_STATUS_KEY_PATH)
+                self.observing_status = False
             self.player.pause()
-            # #region agent log
-            import json; log_data = {"sessionId": "debug-session", "runId": "cleanup", "hypothesisId": "H2", "location": "video_wallpaper_window.py:cleanup:player_paused", "message": "Player paused", "data": {}, "timestamp": int(__import__('time').time() * 1000)}; open("/Users/shotan/Documents/GitHub/superpaper/.cursor/debug.log", "a").write(json.dumps(log_data) + "\n")
-            # #endregion
+        if self.loop_observer is not None:
+            _stop_looping(self.loop_observer)
+        
+        if self.decode_state is not None:
+            self.decode_state["cancelled"] = True
+            self.player_layer.stopRequestingMediaData()
+            self.player_layer.flush()
+            self.decode_state["reader"].cancelReading()
         
         # Remove layer before closing window
-        if self.player_layer and self.window:
-            self.player_layer.removeFromSuperlayer()
-            # #region agent log
-            import json; log_data = {"sessionId": "debug-session", "runId": "cleanup", "hypothesisId": "H2", "location": "video_wallpaper_window.py:cleanup:layer_removed", "message": "Layer removed", "data": {}, "timestamp": int(__import__('time').time() * 1000)}; open("/Users/shotan/Documents/GitHub/superpaper/.cursor/debug.log", "a").write(json.dumps(log_data) + "\n")
-            # #endregion
+        if self.window:
+            self.window.orderOut_(None)
+            if self.player_layer:
+                self.player_layer.removeFromSuperlayer()
         
+        self.loop_observer = None
+        self.player = None
+        self.player_layer = None
+        self.decode_state = None
+        self.decode_queue = None
+    
+    def closeWindow(self):
+        """Close and release the window."""
         if self.window:
             self.window.setReleasedWhenClosed_(True)
             self.window.close()
-            # #region agent log
-            import json; log_data = {"sessionId": "debug-session", "runId": "cleanup", "hypothesisId": "H2", "location": "video_wallpaper_window.py:cleanup:window_closed", "message": "Window closed", "data": {}, "timestamp": int(__import__('time').time() * 1000)}; open("/Users/shotan/Documents/GitHub/superpaper/.cursor/debug.log", "a").write(json.dumps(log_data) + "\n")
-            # #endregion
             self.window = None
         
-        # #region agent log
-        import json; log_data = {"sessionId": "debug-session", "runId": "cleanup", "hypothesisId": "H2", "location": "video_wallpaper_window.py:cleanup:before_clear_refs", "message": "Before clearing references", "data": {}, "timestamp": int(__import__('time').time() * 1000)}; open("/Users/shotan/Documents/GitHub/superpaper/.cursor/debug.log", "a").write(json.dumps(log_data) + "\n")
-        # #endregion
-        
-        self.looper = None
-        self.player = None
-        self.player_layer = None
-        
-        # #region agent log
-        import json; log_data = {"sessionId": "debug-session", "runId": "cleanup", "hypothesisId": "H2", "location": "video_wallpaper_window.py:cleanup:complete", "message": "Cleanup complete", "data": {}, "timestamp": int(__import__('time').time() * 1000)}; open("/Users/shotan/Documents/GitHub/superpaper/.cursor/debug.log", "a").write(json.dumps(log_data) + "\n")
-        # #endregion
-        
         sp_logging.G_LOGGER.info("Video wallpaper window cleaned up")
 
 
@@ -297,7 +736,16 @@ class SPVideoWallpaperManager(NSObject):
         if self is None:
             return None
         
-        self.windows = []
+        # display_id -> SPVideoWallpaperWindow
+        self.windows = {}
+        # (video_path, display_ids, screens, volume, scale_mode) of the active spanned wallpaper
+        self.span_key = None
+        # Player and loop observer shared by the windows of a spanned wallpaper
+        self.shared_player = None
+        self.shared_loop_observer = None
+        self.observing_status = False
+        # Bumped on every stop so late asynchronous loads can be discarded
+        self.generation = 0
         sp_logging.G_LOGGER.info("SPVideoWallpaperManager initialized")
         return self
     
@@ -317,132 +765,205 @@ class SPVideoWallpaperManager(NSObject):
         
         Returns:
             True if at least one window was created successfully
-        """
-        # Clean up existing windows first
-        self.stopAllWallpapers()
         
+        Only displays whose wallpaper or screen changed, or whose video
+        failed to start, are rebuilt; repeating the current request
+        leaves the running windows untouched.
+        """
         # Check if we should span a single video across all displays
-        is_spanning = len(set(video_paths)) == 1 and len(video_paths) > 1
+        n = len(video_paths)
+        is_spanning = n > 1 and all(p is video_paths[0] or p == video_paths[0] for p in video_paths)
         
         if is_spanning:
+            all_ns_screens = NSScreen.screens()
+            span_key = (
+                video_paths[0],
+                tuple(sorted(display_ids)),
+                tuple(_screen_key(screen) for screen in all_ns_screens),
+                volume, scale_mode
+            )
+            if span_key == self.span_key and self.shared_player is not None:
+                sp_logging.G_LOGGER.info("Spanned video wallpaper unchanged, keeping current windows")
+                return True
+            
             # Span mode: one video across multiple displays
+            self.stopAllWallpapers()
             sp_logging.G_LOGGER.info(f"Spanning video across {len(display_ids)} displays")
-            return self.__start_spanned_wallpaper(video_paths[0], display_ids, volume, scale_mode)
+            if not self.__start_spanned_wallpaper(video_paths[0], display_ids, all_ns_screens, volume, scale_mode):
+                return False
+            self.span_key = span_key
+            return True
         else:
+            # Windows of a spanned wallpaper share a player and cannot be reused
+            if self.span_key is not None:
+                self.stopAllWallpapers()
+            
             # Individual mode: separate video for each display
             sp_logging.G_LOGGER.info(f"Playing individual videos on {len(display_ids)} displays")
             return self.__start_individual_wallpapers(video_paths, display_ids, volume, scale_mode)
     
-    def __start_spanned_wallpaper(self, video_path, display_ids, volume, scale_mode):
+    def __start_spanned_wallpaper(self, video_path, display_ids, all_ns_screens, volume, scale_mode):
         """
         Start a single video spanned across multiple displays.
         
         Args:
             video_path: Path to video file
             display_ids: List of CGDirectDisplayIDs
+            all_ns_screens: Result of NSScreen.screens(), indexed by display_ids
             volume: Audio volume
             scale_mode: Scaling mode
         
         Returns:
             True if successful
         """
-        # #region agent log
-        import json; log_data = {"sessionId": "debug-session", "runId": "span", "hypothesisId": "H1", "location": "video_wallpaper_window.py:__start_spanned_wallpaper:entry", "message": "Starting spanned wallpaper", "data": {"video_path": video_path, "display_ids": display_ids, "volume": volume, "scale_mode": scale_mode}, "timestamp": int(__import__('time').time() * 1000)}; open("/Users/shotan/Documents/GitHub/superpaper/.cursor/debug.log", "a").write(json.dumps(log_data) + "\n")
-        # #endregion
-        
-        # #region agent log
-        all_screens_info = []
-        for idx, ns_screen in enumerate(NSScreen.screens()):
-            screen_dict = ns_screen.deviceDescription()
-            screen_number = screen_dict.get("NSScreenNumber", None)
-            frame = ns_screen.frame()
-            all_screens_info.append({"index": idx, "NSScreenNumber": int(screen_number) if screen_number else None, "origin_x": float(frame.origin.x), "origin_y": float(frame.origin.y), "width": float(frame.size.width), "height": float(frame.size.height)})
-        import json; log_data = {"sessionId": "debug-session", "runId": "span", "hypothesisId": "H8", "location": "video_wallpaper_window.py:__start_spanned_wallpaper:all_screens", "message": "All available NSScreens", "data": {"screens_count": len(all_screens_info), "screens": all_screens_info}, "timestamp": int(__import__('time').time() * 1000)}; open("/Users/shotan/Documents/GitHub/superpaper/.cursor/debug.log", "a").write(json.dumps(log_data) + "\n")
-        # #endregion
-        
-        # Get all screens and calculate the bounding canvas
-        screens = []
-        min_x = float('inf')
-        min_y = float('inf')
-        max_x = float('-inf')
-        max_y = float('-inf')
+        if _DBG.isEnabledFor(logging.DEBUG):
+            _DBG.debug("span:entry video=%s displays=%s volume=%s scale_mode=%s", video_path, display_ids, volume, scale_mode)
+        
+        # display_id is actually an index into NSScreen.screens(), not NSScreenNumber
+        if _DBG.isEnabledFor(logging.DEBUG):
+            _debug_log_screens(all_ns_screens)
         
+        # Get all screens and their frames as (x, y, width, height) rows
+        screens = []
+        frame_rows = []
         for display_id in display_ids:
-            # display_id is actually an index into NSScreen.screens(), not NSScreenNumber
-            all_ns_screens = NSScreen.screens()
             if display_id >= len(all_ns_screens):
                 sp_logging.G_LOGGER.warning(f"Display index {display_id} out of range (only {len(all_ns_screens)} screens available)")
                 continue
             
             screen = all_ns_screens[display_id]
-            
-            # #region agent log
-            screen_dict = screen.deviceDescription()
-            screen_number = screen_dict.get("NSScreenNumber", None)
-            import json; log_data = {"sessionId": "debug-session", "runId": "span", "hypothesisId": "H6_FIX", "location": "video_wallpaper_window.py:__start_spanned_wallpaper:found_by_index", "message": f"Found screen by index {display_id}", "data": {"display_index": display_id, "screen_number": int(screen_number) if screen_number else None}, "timestamp": int(__import__('time').time() * 1000)}; open("/Users/shotan/Documents/GitHub/superpaper/.cursor/debug.log", "a").write(json.dumps(log_data) + "\n")
-            # #endregion
-            
             frame = screen.frame()
-            # #region agent log
-            import json; log_data = {"sessionId": "debug-session", "runId": "span", "hypothesisId": "H5", "location": "video_wallpaper_window.py:__start_spanned_wallpaper:frame", "message": f"Screen frame for display {display_id}", "data": {"display_id": display_id, "origin_x": float(frame.origin.x), "origin_y": float(frame.origin.y), "width": float(frame.size.width), "height": float(frame.size.height)}, "timestamp": int(__import__('time').time() * 1000)}; open("/Users/shotan/Documents/GitHub/superpaper/.cursor/debug.log", "a").write(json.dumps(log_data) + "\n")
-            # #endregion
             
             screens.append((screen, display_id))
-            min_x = min(min_x, frame.origin.x)
-            min_y = min(min_y, frame.origin.y)
-            max_x = max(max_x, frame.origin.x + frame.size.width)
-            max_y = max(max_y, frame.origin.y + frame.size.height)
+            frame_rows.append((frame.origin.x, frame.origin.y, frame.size.width, frame.size.height))
         
         if not screens:
             sp_logging.G_LOGGER.error("No screens found for spanning")
             return False
         
-        # Calculate canvas dimensions
-        canvas_width = max_x - min_x
-        canvas_height = max_y - min_y
+        # Calculate the bounding canvas
+        frames = np.array(frame_rows, dtype=np.float64)
+        min_xy = frames[:, :2].min(axis=0)
+        max_xy = (frames[:, :2] + frames[:, 2:]).max(axis=0)
+        canvas = max_xy - min_xy
+        canvas_width, canvas_height = canvas
         
-        # #region agent log
-        import json; log_data = {"sessionId": "debug-session", "runId": "span", "hypothesisId": "H2", "location": "video_wallpaper_window.py:__start_spanned_wallpaper:canvas", "message": "Canvas calculated", "data": {"min_x": float(min_x), "min_y": float(min_y), "max_x": float(max_x), "max_y": float(max_y), "canvas_width": float(canvas_width), "canvas_height": float(canvas_height)}, "timestamp": int(__import__('time').time() * 1000)}; open("/Users/shotan/Documents/GitHub/superpaper/.cursor/debug.log", "a").write(json.dumps(log_data) + "\n")
-        # #endregion
+        if _DBG.isEnabledFor(logging.DEBUG):
+            _DBG.debug("span:canvas min=%s max=%s size=%sx%s", min_xy, max_xy, canvas_width, canvas_height)
         
         sp_logging.G_LOGGER.info(f"Canvas size: {canvas_width}x{canvas_height}")
         
-        # Create a window for each display with appropriate crop rect
-        success_count = 0
-        for screen, display_id in screens:
-            frame = screen.frame()
-            
-            # Calculate normalized crop rectangle for this display
-            # Note: macOS coordinate system has origin at bottom-left
-            crop_x = (frame.origin.x - min_x) / canvas_width
-            crop_y = (frame.origin.y - min_y) / canvas_height
-            crop_width = frame.size.width / canvas_width
-            crop_height = frame.size.height / canvas_height
-            
-            crop_rect = (crop_x, crop_y, crop_width, crop_height)
-            
-            # #region agent log
-            import json; log_data = {"sessionId": "debug-session", "runId": "span", "hypothesisId": "H3", "location": "video_wallpaper_window.py:__start_spanned_wallpaper:crop", "message": f"Crop rect for display {display_id}", "data": {"display_id": display_id, "frame_x": float(frame.origin.x), "frame_y": float(frame.origin.y), "frame_w": float(frame.size.width), "frame_h": float(frame.size.height), "crop_x": float(crop_x), "crop_y": float(crop_y), "crop_width": float(crop_width), "crop_height": float(crop_height)}, "timestamp": int(__import__('time').time() * 1000)}; open("/Users/shotan/Documents/GitHub/superpaper/.cursor/debug.log", "a").write(json.dumps(log_data) + "\n")
-            # #endregion
+        # Normalized crop rectangle (x, y, width, height) of each display
+        # within the canvas. Note: macOS coordinate system has origin at bottom-left
+        crops = np.column_stack([(frames[:, :2] - min_xy) / canvas, frames[:, 2:] / canvas])
+        crop_rects = [tuple(crop) for crop in crops.tolist()]
+        
+        for (screen, display_id), frame, crop_rect in zip(screens, frame_rows, crop_rects):
+            if _DBG.isEnabledFor(logging.DEBUG):
+                _DBG.debug("span:crop display=%s crop=%s", display_id, crop_rect)
             
             sp_logging.G_LOGGER.info(
-                f"Display {display_id}: pos=({frame.origin.x:.0f},{frame.origin.y:.0f}), "
-                f"size=({frame.size.width:.0f}x{frame.size.height:.0f}), "
-                f"crop=({crop_x:.3f},{crop_y:.3f},{crop_width:.3f},{crop_height:.3f})"
+                "Display %s: pos=(%.0f,%.0f), size=(%.0fx%.0f), crop=(%.3f,%.3f,%.3f,%.3f)",
+                display_id, *frame, *crop_rect
             )
-            
-            window = SPVideoWallpaperWindow.createWithVideo_screen_volume_scaleMode_cropRect_(
-                video_path, screen, volume, scale_mode, crop_rect
+        
+        success_count = self.createSpanned_screens_volume_scaleMode_cropRects_(
+            video_path, screens, volume, scale_mode, crop_rects
+        )
+        return success_count > 0
+    
+    def createSpanned_screens_volume_scaleMode_cropRects_(self, video_path, screens, volume, scale_mode, crop_rects):
+        """
+        Create one window per screen, all showing a single shared player.
+        
+        The video is decoded once; each window only adds an AVPlayerLayer
+        pointing at the shared player, offset to its part of the canvas.
+        
+        Args:
+            video_path: Path to video file
+            screens: List of (NSScreen, display_id) tuples
+            volume: Audio volume
+            scale_mode: Scaling mode
+            crop_rects: Normalized crop rect for each screen
+        
+        Returns:
+            Number of windows created
+        """
+        if not os.path.exists(video_path):
+            sp_logging.G_LOGGER.error(f"Video file not found: {video_path}")
+            return 0
+        
+        # Windows are shown right away; the player is attached once loaded.
+        # All their layers are committed to the render server in one transaction.
+        windows = []
+        CATransaction.begin()
+        CATransaction.setDisableActions_(True)
+        try:
+            for (screen, display_id), crop_rect in zip(screens, crop_rects):
+                window = SPVideoWallpaperWindow.createWithSharedPlayer_screen_scaleMode_cropRect_(
+                    None, screen, scale_mode, crop_rect
+                )
+                
+                if window:
+                    windows.append(window)
+                    self.windows[display_id] = window
+                    sp_logging.G_LOGGER.info(f"Created spanned video window for display {display_id}")
+                else:
+                    sp_logging.G_LOGGER.error(f"Failed to create window for display {display_id}")
+        finally:
+            CATransaction.commit()
+        
+        if windows:
+            generation = self.generation
+            _load_asset(
+                video_path,
+                lambda asset: self.startSharedAsset_windows_volume_generation_(
+                    asset, windows, volume, generation
+                )
+            )
+        return len(windows)
+    
+    def startSharedAsset_windows_volume_generation_(self, asset, windows, volume, generation):
+        """Play the loaded asset with one player shared by the spanned windows."""
+        if asset is None or generation != self.generation:
+            return  # Loading failed, or the wallpapers were stopped meanwhile
+        # The canvas was laid out before the video size was known
+        video_tracks = asset.tracksWithMediaType_(AVMediaTypeVideo)
+        video_size = None
+        if video_tracks:
+            # Apply the track's rotation to get the displayed size
+            render_size = CGSizeApplyAffineTransform(
+                video_tracks[0].naturalSize(), video_tracks[0].preferredTransform()
             )
+            video_size = NSMakeSize(abs(render_size.width), abs(render_size.height))
+        
+        CATransaction.begin()
+        CATransaction.setDisableActions_(True)
+        try:
+            for window in windows:
+                window.layoutCanvasForVideoSize_(video_size)
             
-            if window:
-                self.windows.append(window)
-                success_count += 1
-                sp_logging.G_LOGGER.info(f"Created spanned video window for display {display_id}")
-            else:
-                sp_logging.G_LOGGER.error(f"Failed to create window for display {display_id}")
+            # The video is never shown larger than the canvas
+            scale = max(window.window.backingScaleFactor() for window in windows)
+            canvas_size = windows[0].canvas_size
+            self.shared_player, self.shared_loop_observer = _create_looping_player(
+                asset, volume, NSMakeSize(canvas_size.width * scale, canvas_size.height * scale)
+            )
+            for window in windows:
+                window.setSharedPlayer_(self.shared_player)
+        finally:
+            CATransaction.commit()
         
-        return success_count > 0
+        # Playback starts once the first item is ready
+        self.observing_status = True
+        _observe_item_status(self, self.shared_player)
+    
+    def observeValueForKeyPath_ofObject_change_context_(self, key_path, obj, change, context):
+        """Start the shared player once its item becomes ready to play."""
+        if key_path != _ITEM_STATUS_KEY_PATH or not self.observing_status:
+            return
+        if _play_when_ready(self, self.shared_player):
+            self.observing_status = False
     
     def __start_individual_wallpapers(self, video_paths, display_ids, volume, scale_mode):
         """
@@ -458,34 +979,78 @@ class SPVideoWallpaperManager(NSObject):
             True if at least one window was created successfully
         """
         success_count = 0
+        requested = dict(zip(display_ids, video_paths))
         
-        for video_path, display_id in zip(video_paths, display_ids):
-            # display_id is actually an index into NSScreen.screens()
-            all_ns_screens = NSScreen.screens()
-            if display_id >= len(all_ns_screens):
-                sp_logging.G_LOGGER.warning(f"Display index {display_id} out of range, using main screen")
-                screen = NSScreen.mainScreen()
-            else:
-                screen = all_ns_screens[display_id]
-            
-            # Create window without crop (full video on this display)
-            window = SPVideoWallpaperWindow.createWithVideo_screen_volume_scaleMode_cropRect_(
-                video_path, screen, volume, scale_mode, None
-            )
+        # display_id is actually an index into NSScreen.screens()
+        all_ns_screens = NSScreen.screens()
+        
+        CATransaction.begin()
+        CATransaction.setDisableActions_(True)
+        try:
+            # Remove windows of displays that are no longer requested
+            for display_id in [d for d in self.windows if d not in requested]:
+                self.windows.pop(display_id).cleanup()
             
-            if window:
-                self.windows.append(window)
-                success_count += 1
-                sp_logging.G_LOGGER.info(f"Started video wallpaper on display {display_id}")
-            else:
-                sp_logging.G_LOGGER.error(f"Failed to create video wallpaper window for display {display_id}")
+            for display_id, video_path in requested.items():
+                if display_id >= len(all_ns_screens):
+                    sp_logging.G_LOGGER.warning(f"Display index {display_id} out of range, using main screen")
+                    screen = NSScreen.mainScreen()
+                else:
+                    screen = all_ns_screens[display_id]
+                
+                wallpaper_key = (video_path, _screen_key(screen), volume, scale_mode)
+                current = self.windows.get(display_id)
+                if current is not None:
+                    if current.wallpaper_key == wallpaper_key and current.hasStartedVideo():
+                        success_count += 1
+                        continue
+                    del self.windows[display_id]
+                    current.cleanup()
+                
+                # Create window without crop (full video on this display)
+                window = SPVideoWallpaperWindow.createWithVideo_screen_volume_scaleMode_cropRect_(
+                    video_path, screen, volume, scale_mode, None
+                )
+                
+                if window:
+                    window.wallpaper_key = wallpaper_key
+                    self.windows[display_id] = window
+                    success_count += 1
+                    sp_logging.G_LOGGER.info(f"Started video wallpaper on display {display_id}")
+                else:
+                    sp_logging.G_LOGGER.error(f"Failed to create video wallpaper window for display {display_id}")
+        finally:
+            CATransaction.commit()
         
         return success_count > 0
     
     def stopAllWallpapers(self):
         """Stop and cleanup all video wallpaper windows."""
-        for window in self.windows:
-            window.cleanup()
-        
-        self.windows = []
+        # Tear all windows down in one transaction and release what they
+        # autoreleased in one batch; windows are closed once it is committed
+        with objc.autorelease_pool():
+            CATransaction.begin()
+            CATransaction.setDisableActions_(True)
+            try:
+                for window in self.windows.values():
+                    window.tearDown()
+            finally:
+                CATransaction.commit()
+            for window in self.windows.values():
+                window.closeWindow()
+            
+            self.windows = {}
+            self.span_key = None
+            
+            # Release the shared player only once no window displays it
+            if self.shared_player is not None:
+                if self.observing_status:
+                    self.shared_player.currentItem().removeObserver_forKeyPath_(self, _ITEM_STATUS_KEY_PATH)
+                    self.observing_status = False
+                self.shared_player.pause()
+            if self.shared_loop_observer is not None:
+                _stop_looping(self.shared_loop_observer)
+            self.shared_loop_observer = None
+            self.shared_player = None
+            self.generation += 1
         sp_logging.G_LOGGER.info("All video wallpapers stopped")